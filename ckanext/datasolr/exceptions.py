@@ -9,3 +9,21 @@ class DataSolrException(Exception):
     '''An Exception thrown by the ckanext-datasolr plugin.'''
     # TODO: write a more useful exception
     pass
+
+
+class SolrResponseTooLarge(DataSolrException):
+    '''Raised when a Solr response is larger than the configured maximum.'''
+
+    def __init__(self, max_bytes):
+        super(SolrResponseTooLarge, self).__init__(
+            u'Solr response exceeded the maximum of {0} bytes'.format(max_bytes))
+        self.max_bytes = max_bytes
+
+
+class SolrOverloaded(DataSolrException):
+    '''Raised when a request to Solr is refused by admission control.'''
+
+    def __init__(self, resource_id):
+        super(SolrOverloaded, self).__init__(
+            u'Too many concurrent searches on resource {0}'.format(resource_id))
+        self.resource_id = resource_id
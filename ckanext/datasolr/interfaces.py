@@ -94,3 +94,53 @@ class IDataSolr(interfaces.Interface):
 
         '''
         return query_dict
+
+    def datasolr_after_fetch_fields(self, context, data_dict):
+        '''Declare the fields needed by ``datasolr_after_fetch``
+
+        Fields returned here are added to the list of fields requested from
+        Solr, so they are available to ``datasolr_after_fetch`` even if the
+        user didn't ask for them. Fields that were only added for this purpose
+        are removed from the records once every ``datasolr_after_fetch`` hook
+        has run. Fields are not added to distinct queries, which group on the
+        requested fields, nor to searches that don't list their fields.
+
+        :param context: the context
+        :type context: dictionary
+        :param data_dict: the validated parameters received from the user
+        :type data_dict: dictionary
+        :returns: the names of the fields your hook needs
+        :rtype: list
+
+        '''
+        return []
+
+    def datasolr_after_fetch(self, context, data_dict, fields_index, response):
+        '''Modify the results of a datastore_solr_search in bulk
+
+        This is called once per request, after the records have been fetched
+        from Solr, with the whole result page. Use it to enrich or reshape the
+        records with batched work - for instance, collect the values you need
+        from every record and perform a single bulk lookup for the page rather
+        than one lookup per record.
+
+        As with ``datasolr_search``, the ``response`` is passed to each
+        IDataSolr extension in the order they've been loaded. If no extension
+        overrides this method, it is not called at all.
+
+        :param context: the context
+        :type context: dictionary
+        :param data_dict: the validated parameters received from the user
+        :type data_dict: dictionary
+        :param fields_index: the current resource's stored fields, keyed by
+            field name
+        :type fields_index: dictionary
+        :param response: the response as it will be returned to the user,
+            with ``records``, ``fields``, ``total`` and, where requested,
+            ``facets`` and ``next_cursor``
+        :type response: dictionary
+        :returns: the response with your modifications
+        :rtype: dictionary
+
+        '''
+        return response
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# This file is part of ckanext-datasolr
+# Created by the Natural History Museum in London, UK
+
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+
+from ckanext.datasolr.exceptions import SolrOverloaded
+from ckanext.datasolr.lib.config import get_admission_options
+
+# Request classes, in order of priority
+CHEAP = 0
+NORMAL = 1
+EXPENSIVE = 2
+
+
+def is_autocomplete(q):
+    '''Check whether a query is a field autocompletion, as detected by
+    SolrSearch.build_query - a single field whose value ends with ``:*``
+
+    :param q: the ``q`` parameter
+    :returns: boolean (True if the query is an autocompletion)
+
+    '''
+    if not isinstance(q, dict) or len(q) != 1:
+        return False
+    value = list(q.values())[0]
+    return isinstance(value, basestring) and value.endswith(u':*')
+
+
+def request_priority(params, solr_params, deep_offset):
+    '''Classify a search by how expensive it is for Solr
+
+    Facets, distinct queries and deep pages are expensive, whatever else the
+    request does; otherwise autocompletes and counts are cheap, and
+    everything else is normal.
+
+    :param params: the validated API parameters
+    :param solr_params: the solr parameters
+    :param deep_offset: the offset from which a page is considered deep
+    :returns: the priority of the request (CHEAP, NORMAL or EXPENSIVE)
+
+    '''
+    if solr_params.get(u'facet') or solr_params.get(u'group') or \
+            int(solr_params.get(u'start', 0) or 0) >= deep_offset:
+        return EXPENSIVE
+    if is_autocomplete(params.get(u'q')):
+        return CHEAP
+    if int(solr_params.get(u'rows', 0) or 0) == 0:
+        return CHEAP
+    return NORMAL
+
+
+class ConcurrencyLimiter(object):
+    '''Limit the number of requests in flight to a Solr core
+
+    Requests over the limit wait in a bounded queue, where they are admitted
+    by priority (then in order of arrival). Requests are refused if the queue
+    is full, or if they waited longer than ``queue_timeout`` seconds.
+
+    :param resource_id: the ID of the resource the limiter applies to
+    :param max_concurrent: the maximum number of requests in flight
+    :param max_queued: the maximum number of requests waiting
+    :param queue_timeout: the maximum number of seconds a request waits
+
+    '''
+
+    def __init__(self, resource_id, max_concurrent, max_queued, queue_timeout):
+        self.resource_id = resource_id
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self._condition = threading.Condition(threading.Lock())
+        self._active = 0
+        self._waiting = []
+        self._counter = itertools.count()
+
+    def acquire(self, priority, wait=True):
+        '''Wait for a slot to become available
+
+        :param priority: the priority of the request (lower goes first)
+        :param wait: if False, refuse the request rather than queue it
+            (optional, default: True)
+
+        '''
+        with self._condition:
+            if self._active < self.max_concurrent and not self._waiting:
+                self._active += 1
+                return
+            if not wait or len(self._waiting) >= self.max_queued:
+                raise SolrOverloaded(self.resource_id)
+
+            ticket = (priority, next(self._counter))
+            heapq.heappush(self._waiting, ticket)
+            deadline = time.time() + self.queue_timeout
+            while self._waiting[0] != ticket or self._active >= self.max_concurrent:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    self._waiting.remove(ticket)
+                    heapq.heapify(self._waiting)
+                    # We may have been blocking the head of the queue
+                    self._condition.notify_all()
+                    raise SolrOverloaded(self.resource_id)
+                self._condition.wait(remaining)
+            heapq.heappop(self._waiting)
+            self._active += 1
+            # There may be room for the next request in the queue too
+            self._condition.notify_all()
+
+    def release(self):
+        '''Free a slot'''
+        with self._condition:
+            self._active -= 1
+            self._condition.notify_all()
+
+
+# Per worker limiters, keyed by resource ID
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(resource_id):
+    '''Return the worker's concurrency limiter for a resource
+
+
+    :param resource_id: the ID of the resource
+    :returns: a ConcurrencyLimiter, or None if the resource isn't limited
+
+    '''
+    with _limiters_lock:
+        if resource_id not in _limiters:
+            options = get_admission_options(resource_id)
+            limiter = None
+            if options[u'max_concurrent'] > 0:
+                limiter = ConcurrencyLimiter(resource_id, options[u'max_concurrent'],
+                                             options[u'max_queued'],
+                                             options[u'queue_timeout'])
+            _limiters[resource_id] = limiter
+        return _limiters[resource_id]
+
+
+@contextmanager
+def admit(resource_id, priority, wait=True):
+    '''Hold a slot on a resource for the duration of the block
+
+    :param resource_id: the ID of the resource
+    :param priority: the priority of the request
+    :param wait: if False, refuse the request rather than queue it
+        (optional, default: True)
+
+    '''
+    limiter = get_limiter(resource_id)
+    if limiter is None:
+        yield
+        return
+    limiter.acquire(priority, wait)
+    try:
+        yield
+    finally:
+        limiter.release()
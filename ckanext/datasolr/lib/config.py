@@ -18,3 +18,89 @@ def get_datasolr_resources():
     config_key = u'ckanext.datasolr.'
     return {k.replace(config_key, u''): toolkit.config.get(k) for k in toolkit.config.keys() if
             config_key in k}
+
+
+def get_cursor_prefetch_options():
+    '''Return the cursor prefetching options, as defined in the CKAN
+    configuration
+
+
+    :returns: a dictionary of the cursor prefetch options
+
+    '''
+    config = toolkit.config
+    return {
+        u'enabled': toolkit.asbool(config.get(u'datasolr.cursor_prefetch', False)),
+        u'max_entries': toolkit.asint(
+            config.get(u'datasolr.cursor_prefetch.max_entries', 8)),
+        u'ttl': toolkit.asint(config.get(u'datasolr.cursor_prefetch.ttl', 60)),
+        u'max_rows': toolkit.asint(
+            config.get(u'datasolr.cursor_prefetch.max_rows', 1000)),
+        u'wait': float(config.get(u'datasolr.cursor_prefetch.wait', 2)),
+        }
+
+
+def get_resource_option(resource_id, key, default=None):
+    '''Return a datasolr option for a resource, as defined in the CKAN
+    configuration
+
+    Resource specific options (``datasolr.resource.<resource id>.<key>``) take
+    precedence over the global ones (``datasolr.<key>``).
+
+    :param resource_id: the ID of the resource
+    :param key: the name of the option
+    :param default: the value to use if the option isn't set (optional)
+    :returns: the option's value
+
+    '''
+    config = toolkit.config
+    value = config.get(u'datasolr.resource.{0}.{1}'.format(resource_id, key))
+    if value is None:
+        value = config.get(u'datasolr.{0}'.format(key), default)
+    return value
+
+
+def get_connection_options(resource_id):
+    '''Return the options used to create a resource's SolrConnection
+
+
+    :param resource_id: the ID of the resource
+    :returns: a dictionary of keyword arguments for SolrConnection
+
+    '''
+    return {
+        u'compression': toolkit.asbool(
+            get_resource_option(resource_id, u'compression', False)),
+        u'max_response_bytes': toolkit.asint(
+            get_resource_option(resource_id, u'max_response_bytes', 0)),
+        }
+
+
+def get_admission_options(resource_id):
+    '''Return the admission control options for a resource, as defined in the
+    CKAN configuration
+
+
+    :param resource_id: the ID of the resource
+    :returns: a dictionary of the admission control options
+
+    '''
+    return {
+        u'max_concurrent': toolkit.asint(
+            get_resource_option(resource_id, u'max_concurrent', 0)),
+        u'max_queued': toolkit.asint(get_resource_option(resource_id, u'max_queued', 0)),
+        u'queue_timeout': float(get_resource_option(resource_id, u'queue_timeout', 5)),
+        u'deep_offset': toolkit.asint(
+            get_resource_option(resource_id, u'deep_offset', 10000)),
+        }
+
+
+def get_federated_max_resources():
+    '''Return the maximum number of resources a federated search can query, as
+    defined in the CKAN configuration
+
+
+    :returns: the maximum number of resources
+
+    '''
+    return toolkit.asint(toolkit.config.get(u'datasolr.federated_max_resources', 10))
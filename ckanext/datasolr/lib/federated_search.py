@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# This file is part of ckanext-datasolr
+# Created by the Natural History Museum in London, UK
+
+import copy
+import threading
+
+from ckanext.datasolr.lib.config import get_federated_max_resources, get_resource_option
+from ckanext.datasolr.lib.helpers import is_datasolr_resource
+from ckanext.datasolr.lib.solr_search import SolrSearch
+
+import ckanext.datastore.helpers as datastore_helpers
+from ckan.plugins import toolkit
+
+
+def parse_sort(sort):
+    '''Parse a sort parameter into a list of (field name, descending) tuples
+
+    :param sort: comma separated string or list of "field [asc|desc]" terms,
+        or a list of (field, order) tuples
+    :returns: a list of tuples, where the first element is the field name and
+        the second is True if the sort is descending
+
+    '''
+    if not sort:
+        return []
+    if isinstance(sort, basestring):
+        sort = sort.split(u',')
+    sort_keys = []
+    for term in sort:
+        if isinstance(term, (list, tuple)):
+            parts = list(term)
+        else:
+            parts = term.strip().split()
+        if not parts:
+            continue
+        order = parts[1] if len(parts) > 1 else u'asc'
+        sort_keys.append((parts[0], order.lower() == u'desc'))
+    return sort_keys
+
+
+def missing_last_sort(sort):
+    '''Build a Solr sort that puts records with no value for a sort field last
+
+    Where records with no value go otherwise depends on each field's
+    ``sortMissingFirst``/``sortMissingLast`` setting in the Solr schema. Making
+    it explicit means every core returns its records in the same order as
+    ``merge_records`` sorts them.
+
+    :param sort: the sort parameter, as accepted by ``parse_sort``
+    :returns: a list of solr sort clauses
+
+    '''
+    clauses = []
+    for field, descending in parse_sort(sort):
+        clauses.append(u'exists({0}) desc'.format(field))
+        clauses.append(u'{0} {1}'.format(field, u'desc' if descending else u'asc'))
+    return clauses
+
+
+def merge_records(record_lists, sort):
+    '''Merge the records from several resources into one sorted list
+
+    Records with no value for a sort field always come last, which is how
+    ``missing_last_sort`` asks Solr to sort them. Without any sort the records
+    are kept in the order of the resources, then in the order Solr returned
+    them.
+
+    :param record_lists: a list of lists of records
+    :param sort: the sort parameter, as accepted by ``parse_sort``
+    :returns: the merged list of records
+
+    '''
+    records = [record for record_list in record_lists for record in record_list]
+    # Python's sort is stable, so sorting by each key in reverse order of
+    # precedence gives a multi-key sort where each key has its own direction
+    for field, descending in reversed(parse_sort(sort)):
+        if descending:
+            records.sort(key=lambda r: (r.get(field) is not None, r.get(field)),
+                         reverse=True)
+        else:
+            records.sort(key=lambda r: (r.get(field) is None, r.get(field)))
+    return records
+
+
+class FederatedSolrSearch(object):
+    '''Class used to search several datasolr resources in one request
+
+    One query is built per resource using ``SolrSearch``, and the queries are
+    sent to Solr concurrently. Each resource is asked for the first
+    ``offset + limit`` records so the merged, sorted page can be cut out of
+    the combined results.
+
+    :param context: CKAN execution context
+    :param params: search parameters, including the list of ``resource_ids``
+
+    '''
+
+    def __init__(self, context, params):
+        self.context = context
+        self.params = dict(params)
+        resource_ids = datastore_helpers.get_list(
+            self.params.pop(u'resource_ids', None)) or []
+        # Remove duplicates, keeping the order the resources were given in
+        self.resource_ids = []
+        for resource_id in resource_ids:
+            if resource_id not in self.resource_ids:
+                self.resource_ids.append(resource_id)
+        self.offset = 0
+        self.limit = 100
+        self.searches = []
+
+    def _int_param(self, name, default):
+        '''Return a parameter as a positive integer
+
+        :param name: the name of the parameter
+        :param default: the value to use if the parameter isn't set
+        :returns: the parameter's value
+
+        '''
+        value = self.params.pop(name, default)
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            raise toolkit.ValidationError({name: [u'invalid value "{0}"'.format(value)]})
+        if value < 0:
+            raise toolkit.ValidationError({name: [u'must be a positive integer']})
+        return value
+
+    def validate(self):
+        '''Check for errors in the search, and validate the search on each
+        resource'''
+        if not self.resource_ids:
+            raise toolkit.ValidationError({u'resource_ids': [u'Missing value']})
+        max_resources = get_federated_max_resources()
+        if len(self.resource_ids) > max_resources:
+            raise toolkit.ValidationError({
+                u'resource_ids': [u'at most {0} resources can be searched at '
+                                  u'once'.format(max_resources)]
+                })
+        invalid = [r for r in self.resource_ids if not is_datasolr_resource(r)]
+        if invalid:
+            raise toolkit.ValidationError({
+                u'resource_ids': [u'not datasolr resources: {0}'.format(
+                    u', '.join(invalid))]
+                })
+        if self.params.get(u'cursor'):
+            raise toolkit.ValidationError({
+                u'cursor': [u'cursors are not supported when searching several '
+                            u'resources']
+                })
+        self.offset = self._int_param(u'offset', 0)
+        self.limit = self._int_param(u'limit', 100)
+
+        # Each resource is asked for offset + limit records, which must fit
+        # within the resource's maximum limit
+        for resource_id in self.resource_ids:
+            max_limit = toolkit.asint(get_resource_option(resource_id, u'max_limit', 0))
+            if max_limit and self.offset + self.limit > max_limit:
+                raise toolkit.ValidationError({
+                    u'offset': [u'offset + limit must be at most {0} when searching '
+                                u'resource {1}'.format(max_limit, resource_id)]
+                    })
+
+        self.searches = []
+        for resource_id in self.resource_ids:
+            resource_params = copy.deepcopy(self.params)
+            resource_params[u'resource_id'] = resource_id
+            resource_params[u'offset'] = 0
+            resource_params[u'limit'] = self.offset + self.limit
+            search = SolrSearch(resource_id, dict(self.context), resource_params)
+            search.validate()
+            self.searches.append(search)
+
+    def _query_all(self, queries):
+        '''Send the queries to Solr, concurrently if there's more than one
+
+        :param queries: a list of (solr query, solr params) tuples, one per
+            search
+        :returns: a list of solr responses, in the same order
+
+        '''
+        if len(queries) == 1:
+            return [self.searches[0].query(*queries[0])]
+
+        results = [None] * len(queries)
+        errors = [None] * len(queries)
+
+        def run(index, search, solr_query, solr_params):
+            try:
+                results[index] = search.query(solr_query, solr_params)
+            except Exception as e:
+                errors[index] = e
+
+        threads = [threading.Thread(target=run, args=(i, search) + queries[i])
+                   for i, search in enumerate(self.searches)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for error in errors:
+            if error is not None:
+                raise error
+        return results
+
+    def fetch(self):
+        '''Run the queries and fetch the merged data'''
+        # Access checks and the IDataSolr plugins run in this thread - only the
+        # requests to Solr are made concurrently
+        sort = self.searches[0].params.get(u'sort')
+        # Free text searches with no sort are ranked by relevance, so fetch
+        # the score from each core and merge on it
+        by_score = not sort and isinstance(self.params.get(u'q'), basestring) and \
+            bool(self.params[u'q'].strip())
+        queries = []
+        for search in self.searches:
+            toolkit.check_access(u'datastore_search', self.context,
+                                 {u'resource_id': search.resource_id})
+            solr_query, solr_params = search.prepare()
+            if by_score:
+                solr_params[u'score'] = True
+            elif sort:
+                solr_params[u'sort'] = missing_last_sort(sort)
+            queries.append((solr_query, solr_params))
+
+        responses = [search.process(result) for search, result in
+                     zip(self.searches, self._query_all(queries))]
+
+        resources = {}
+        record_lists = []
+        for response in responses:
+            resource_id = response[u'resource_id']
+            for record in response[u'records']:
+                record[u'_resource_id'] = resource_id
+            record_lists.append(response[u'records'])
+            resources[resource_id] = dict(
+                total=response[u'total'],
+                total_is_estimate=response[u'total_is_estimate'],
+                fields=response[u'fields'],
+                )
+            if u'facets' in response:
+                resources[resource_id][u'facets'] = response[u'facets']
+
+        if by_score:
+            records = merge_records(record_lists, [(u'score', u'desc')])
+            for record in records:
+                record.pop(u'score', None)
+        else:
+            records = merge_records(record_lists, sort)
+
+        return dict(
+            resource_ids=self.resource_ids,
+            total=sum(r[u'total'] for r in resources.values()),
+            total_is_estimate=any(r[u'total_is_estimate'] for r in resources.values()),
+            records=records[self.offset:self.offset + self.limit],
+            resources=resources,
+            _backend=u'datasolr',
+            )
@@ -4,8 +4,6 @@
 # This file is part of ckanext-datasolr
 # Created by the Natural History Museum in London, UK
 
-import re
-
 from ckanext.datasolr.lib.config import get_datasolr_resources
 
 
@@ -33,21 +31,71 @@ def split_words(phrase, quotes=True):
     '''
     if not quotes:
         return [w for w in phrase.split(u' ') if w]
-    else:
-        nb_q = len(re.sub(u'[^"]', u'', phrase))
-        if nb_q % 2 == 1:
-            phrase += u'"'
-        parts = re.split(u' (?=(?:[^"]|"[^"]*")*$)', phrase)
-        words = []
-        for w in parts:
-            if w.endswith(u'"'):
-                w = w[:-1]
-            if w.startswith(u'"'):
-                w = w[1:]
-            w = w.replace(u'""', u'"')
-            if w:
-                words.append(w)
-        return words
+    if phrase.count(u'"') % 2 == 1:
+        phrase += u'"'
+    # Single pass over the phrase, splitting on spaces that are not between
+    # double quotes. Each double quote toggles the quoted state, so an
+    # escaped ("") quote leaves it unchanged
+    parts = []
+    current = []
+    in_quotes = False
+    for char in phrase:
+        if char == u'"':
+            in_quotes = not in_quotes
+        elif char == u' ' and not in_quotes:
+            parts.append(u''.join(current))
+            current = []
+            continue
+        current.append(char)
+    parts.append(u''.join(current))
+
+    words = []
+    for w in parts:
+        if w.endswith(u'"'):
+            w = w[:-1]
+        if w.startswith(u'"'):
+            w = w[1:]
+        w = w.replace(u'""', u'"')
+        if w:
+            words.append(w)
+    return words
+
+
+# Characters that have a special meaning in the Solr standard query parser
+SOLR_SPECIAL_CHARS = frozenset(u'+-&|!(){}[]^"~*?:\\/ \t\n\r')
+
+# Words the Solr standard query parser treats as boolean operators
+SOLR_OPERATORS = frozenset([u'AND', u'OR', u'NOT'])
+
+
+def escape_solr_term(term):
+    '''Escape a term for use in a Solr query
+
+    Every character with a special meaning in the Solr query syntax is
+    backslash escaped, so the term is matched literally (no wildcards, ranges,
+    boolean operators...). Boolean operator keywords get their first letter
+    escaped, which makes the parser read them as plain terms.
+
+    :param term: the term to escape
+    :returns: the escaped term
+
+    '''
+    if term in SOLR_OPERATORS:
+        return u'\\' + term
+    return u''.join(u'\\' + c if c in SOLR_SPECIAL_CHARS else c for c in term)
+
+
+def solr_phrase(phrase):
+    '''Quote a phrase for use in a Solr query
+
+    The result is a phrase query, with double quotes and backslashes in the
+    phrase escaped.
+
+    :param phrase: the phrase to quote
+    :returns: the quoted phrase
+
+    '''
+    return u'"{}"'.format(phrase.replace(u'\\', u'\\\\').replace(u'"', u'\\"'))
 
 
 def is_datasolr_resource(resource_id):
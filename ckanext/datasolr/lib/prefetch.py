@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# This file is part of ckanext-datasolr
+# Created by the Natural History Museum in London, UK
+
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from ckanext.datasolr.exceptions import SolrOverloaded
+from ckanext.datasolr.lib.admission import EXPENSIVE, admit
+from ckanext.datasolr.lib.config import get_cursor_prefetch_options
+from ckanext.datasolr.lib.solr_connection import SolrConnection
+
+log = logging.getLogger(__name__)
+
+
+def query_signature(resource_id, solr_query, solr_params):
+    '''Build a signature identifying a cursor query, regardless of the
+    cursor mark
+
+    :param resource_id: the ID of the resource being searched
+    :param solr_query: the solr query
+    :param solr_params: the solr parameters
+    :returns: a string signature
+
+    '''
+    params = {k: v for k, v in solr_params.items() if k != u'cursorMark'}
+    serialised = json.dumps([resource_id, solr_query, params], sort_keys=True,
+                            default=repr)
+    return hashlib.sha1(serialised.encode(u'utf-8')).hexdigest()
+
+
+class _Entry(object):
+    '''A page being, or having been, prefetched'''
+
+    def __init__(self):
+        self.created = time.time()
+        self.ready = threading.Event()
+        self.search = None
+
+
+class CursorPrefetcher(object):
+    '''Prefetch the next page of cursor searches in the background
+
+    Clients walking a resource with a cursor request pages one after the
+    other, and the next page is known as soon as the current one has been
+    fetched. The prefetcher fetches it in a background thread and holds it in
+    a small cache, keyed by query signature and cursor mark, until the client
+    asks for it. Each cached page is served once.
+
+    The cache is per worker process. It holds at most ``max_entries`` pages,
+    dropping the oldest first, and pages are discarded ``ttl`` seconds after
+    they were requested. Pages of more than ``max_rows`` rows are never
+    prefetched. A request for a page that is still being fetched waits at
+    most ``wait`` seconds for it, then queries Solr itself.
+
+    :param max_entries: the maximum number of pages held
+    :param ttl: the number of seconds a page is kept for
+    :param max_rows: the largest page size that will be prefetched
+    :param wait: the number of seconds to wait for a page being fetched
+
+    '''
+
+    def __init__(self, max_entries, ttl, max_rows, wait):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self.wait = wait
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expire(self):
+        '''Remove expired entries - must be called with the lock held'''
+        now = time.time()
+        for key, entry in list(self._entries.items()):
+            if now - entry.created > self.ttl:
+                del self._entries[key]
+
+    def _take(self, key):
+        '''Remove and return the cached search for the given key
+
+        If the page is still being fetched, wait a short while for it - a
+        stuck prefetch shouldn't hold up the client for long.
+
+        :param key: the (signature, cursor mark) key
+        :returns: the solr response, or None if it isn't available
+
+        '''
+        with self._lock:
+            self._expire()
+            entry = self._entries.pop(key, None)
+        if entry is None:
+            return None
+        remaining = min(self.wait, self.ttl - (time.time() - entry.created))
+        if remaining <= 0 or not entry.ready.wait(remaining):
+            return None
+        return entry.search
+
+    def _reserve(self, key):
+        '''Add an empty entry for the given key
+
+        :param key: the (signature, cursor mark) key
+        :returns: the new entry, or None if the key is already present
+
+        '''
+        with self._lock:
+            self._expire()
+            if key in self._entries:
+                return None
+            while len(self._entries) >= self.max_entries:
+                self._entries.popitem(last=False)
+            entry = _Entry()
+            self._entries[key] = entry
+            return entry
+
+    def _prefetch(self, entry, resource_id, solr_url, conn_options, solr_query,
+                  solr_params):
+        '''Fetch a page into an entry - run in a background thread
+
+        Prefetches go through admission control like any other request, but
+        are dropped rather than queued when the resource is busy.
+
+        :param entry: the entry to populate
+        :param resource_id: the ID of the resource being searched
+        :param solr_url: the URL of the Solr core
+        :param conn_options: the keyword arguments for the SolrConnection
+        :param solr_query: the solr query
+        :param solr_params: the solr parameters, including the cursor mark
+
+        '''
+        conn = None
+        try:
+            with admit(resource_id, EXPENSIVE, wait=False):
+                conn = SolrConnection(solr_url, **conn_options)
+                entry.search = conn.query(solr_query, **solr_params)
+        except SolrOverloaded:
+            log.debug(u'Cursor prefetch dropped, resource %s is busy', resource_id)
+        except Exception:
+            log.exception(u'Cursor prefetch failed - query: %s, params: %s',
+                          solr_query, solr_params)
+        finally:
+            entry.ready.set()
+            if conn is not None:
+                conn.close()
+
+    def fetch(self, solr_search, solr_query, solr_params):
+        '''Fetch a cursor page, using the prefetched page if there is one, and
+        start prefetching the following page
+
+        :param solr_search: the SolrSearch performing the request
+        :param solr_query: the solr query
+        :param solr_params: the solr parameters, including the cursor mark
+        :returns: the solr response
+
+        '''
+        signature = query_signature(solr_search.resource_id, solr_query, solr_params)
+        cursor = solr_params[u'cursorMark']
+
+        search = self._take((signature, cursor))
+        if search is None:
+            search = solr_search.query(solr_query, solr_params)
+
+        # Solr returns the cursor mark it was given once the end is reached
+        next_cursor = getattr(search, u'nextCursorMark', None)
+        if next_cursor and next_cursor != cursor and \
+                int(solr_params.get(u'rows', 0)) <= self.max_rows:
+            entry = self._reserve((signature, next_cursor))
+            if entry is not None:
+                next_params = dict(solr_params, cursorMark=next_cursor)
+                thread = threading.Thread(target=self._prefetch,
+                                          args=(entry, solr_search.resource_id,
+                                                solr_search.solr_url,
+                                                solr_search.conn_options, solr_query,
+                                                next_params))
+                thread.daemon = True
+                thread.start()
+
+        return search
+
+
+# Per worker prefetcher, created on first use
+_prefetcher = None
+_prefetcher_lock = threading.Lock()
+
+
+def get_cursor_prefetcher():
+    '''Return the worker's cursor prefetcher, if prefetching is enabled
+
+
+    :returns: a CursorPrefetcher, or None if prefetching is disabled
+
+    '''
+    global _prefetcher
+    options = get_cursor_prefetch_options()
+    if not options[u'enabled']:
+        return None
+    with _prefetcher_lock:
+        if _prefetcher is None:
+            _prefetcher = CursorPrefetcher(options[u'max_entries'], options[u'ttl'],
+                                           options[u'max_rows'], options[u'wait'])
+    return _prefetcher
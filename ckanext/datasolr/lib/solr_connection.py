@@ -6,16 +6,133 @@
 
 import json
 import urllib
+import zlib
 
 import solr
+from ckanext.datasolr.exceptions import SolrResponseTooLarge
+
+
+class DecodedResponse(object):
+    '''Wrap an HTTP response from Solr, decompressing the body as it is read
+    and enforcing a maximum size
+
+    :param response: the HTTP response
+    :param max_bytes: the maximum size of the decoded body, or 0 for no limit
+    :param on_abort: called when the body is abandoned for being too large
+
+    '''
+
+    chunk_size = 64 * 1024
+
+    def __init__(self, response, max_bytes, on_abort):
+        self._response = response
+        self.max_bytes = max_bytes
+        self.on_abort = on_abort
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+    def _decompressor(self, first_chunk):
+        '''Return a decompressor for the body, or None if it isn't compressed
+
+        :param first_chunk: the first chunk of the body
+        :returns: a zlib decompression object or None
+
+        '''
+        encoding = (self._response.getheader(u'content-encoding') or u'').lower()
+        if encoding == u'gzip':
+            return zlib.decompressobj(16 + zlib.MAX_WBITS)
+        if encoding == u'deflate':
+            # Some servers send raw deflate data rather than the zlib format
+            if first_chunk and ord(first_chunk[0:1]) & 0x0f == 8:
+                return zlib.decompressobj()
+            return zlib.decompressobj(-zlib.MAX_WBITS)
+        return None
+
+    def _decode(self, decompressor, chunk):
+        '''Decompress a chunk of the body, a bounded piece at a time
+
+        :param decompressor: the zlib decompression object, or None
+        :param chunk: the chunk of the body
+        :returns: a generator of decoded pieces
+
+        '''
+        if decompressor is None:
+            yield chunk
+            return
+        while chunk:
+            yield decompressor.decompress(chunk, self.chunk_size)
+            chunk = decompressor.unconsumed_tail
+
+    def read(self):
+        '''Read and decode the whole body
+
+
+        :returns: the decoded body
+
+        '''
+        pieces = []
+        size = 0
+        decompressor = None
+        first = True
+        while True:
+            chunk = self._response.read(self.chunk_size)
+            if first:
+                decompressor = self._decompressor(chunk)
+                first = False
+            if not chunk:
+                break
+            for piece in self._decode(decompressor, chunk):
+                size += len(piece)
+                if self.max_bytes and size > self.max_bytes:
+                    self.on_abort()
+                    raise SolrResponseTooLarge(self.max_bytes)
+                pieces.append(piece)
+        if decompressor is not None:
+            pieces.append(decompressor.flush())
+        return b''.join(pieces)
 
 
 class SolrConnection(solr.SolrConnection):
-    '''Extend solr connection with a schema call'''
+    '''Extend solr connection with a schema call, compressed transport and
+    a maximum response size
+
+    :param url: the URL of the Solr core
+    :param compression: if True, ask Solr for gzip or deflate compressed
+        responses (optional, default: False)
+    :param max_response_bytes: the maximum size of a decoded response, or 0
+        for no limit (optional, default: 0)
+
+    '''
 
     # Field cache - keyed by connection URL to prevent clashes
     _fields_cache = {}
 
+    def __init__(self, url, compression=False, max_response_bytes=0, **kwargs):
+        solr.SolrConnection.__init__(self, url, **kwargs)
+        self.compression = compression
+        self.max_response_bytes = max_response_bytes
+
+    def _post(self, url, body, headers, capped=True):
+        '''Post a request to Solr, negotiating compression if enabled
+
+        :param url: the selector to post to
+        :param body: the request body
+        :param headers: the request headers
+        :param capped: if False, the response isn't limited to
+            ``max_response_bytes`` (optional, default: True)
+        :returns: the response, decoded as it is read
+
+        '''
+        if self.compression:
+            headers = dict(headers)
+            headers[u'Accept-Encoding'] = u'gzip, deflate'
+        response = solr.SolrConnection._post(self, url, body, headers)
+        # Abandoning a partially read body leaves the HTTP connection unusable,
+        # so it is closed (and reopened by the next request)
+        max_bytes = self.max_response_bytes if capped else 0
+        return DecodedResponse(response, max_bytes, self.conn.close)
+
     def fields(self):
         '''Get all fields.
 
@@ -34,7 +151,9 @@ class SolrConnection(solr.SolrConnection):
 
             selector = self.path + '/admin/luke'
 
-            rsp = self._post(selector, request, self.form_headers)
+            # The schema is needed by every search, so it isn't subject to the
+            # maximum response size meant for search results
+            rsp = self._post(selector, request, self.form_headers, capped=False)
             data = rsp.read()
             solr_schema = json.loads(data)
 
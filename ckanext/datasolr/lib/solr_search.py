@@ -9,8 +9,12 @@ import logging
 
 import solr
 from ckanext.datasolr.interfaces import IDataSolr
-from ckanext.datasolr.lib.config import get_datasolr_resources
-from ckanext.datasolr.lib.helpers import split_words
+from ckanext.datasolr.exceptions import SolrOverloaded, SolrResponseTooLarge
+from ckanext.datasolr.lib.admission import admit, request_priority
+from ckanext.datasolr.lib.config import (get_admission_options, get_connection_options,
+                                         get_datasolr_resources, get_resource_option)
+from ckanext.datasolr.lib.helpers import escape_solr_term, solr_phrase, split_words
+from ckanext.datasolr.lib.prefetch import get_cursor_prefetcher
 from ckanext.datasolr.lib.solr_connection import SolrConnection
 from ckanext.datasolr.logic.schema import datastore_search_schema
 
@@ -20,6 +24,34 @@ from ckan.plugins import PluginImplementations, toolkit
 log = logging.getLogger(__name__)
 
 
+def _overrides(plugin, method_name):
+    '''Check whether a plugin provides its own implementation of an IDataSolr
+    method, rather than the default one inherited from the interface
+
+    :param plugin: the plugin to check
+    :param method_name: the name of the IDataSolr method
+    :returns: boolean (True if the plugin implements the method itself)
+
+    '''
+    method = getattr(type(plugin), method_name, None)
+    if method is None:
+        return False
+    default = getattr(IDataSolr, method_name)
+    return getattr(method, u'__func__', method) is not getattr(default, u'__func__',
+                                                              default)
+
+
+def _after_fetch_plugins():
+    '''Return the IDataSolr plugins implementing datasolr_after_fetch
+
+
+    :returns: a list of plugins, in the order they've been loaded
+
+    '''
+    return [plugin for plugin in PluginImplementations(IDataSolr) if
+            _overrides(plugin, u'datasolr_after_fetch')]
+
+
 class SolrSearch(object):
     '''Class used to implement the solr search action
 
@@ -34,12 +66,18 @@ class SolrSearch(object):
         self.params = params
         self.resource_id = resource_id
         datasolr_resources = get_datasolr_resources()
-        self.conn = SolrConnection(datasolr_resources[resource_id])
+        self.solr_url = datasolr_resources[resource_id]
+        self.conn_options = get_connection_options(resource_id)
+        self.conn = SolrConnection(self.solr_url, **self.conn_options)
         # Flag to denote whether to only return fields which have been indexed
         # Used when we need to provide a list of filters
         self.indexed_only = params.get(u'indexed_only', False)
         self.indexed_fields = self.conn.indexed_fields()
         self.stored_fields = self.conn.stored_fields()
+        # IDataSolr plugins implementing datasolr_after_fetch, and the fields
+        # requested only for them - both set when the query is prepared
+        self.after_fetch = []
+        self.hook_only_fields = set()
 
     def _check_access(self):
         '''Ensure we have access to the defined resource'''
@@ -93,22 +131,107 @@ class SolrSearch(object):
         if len(error_list) > 0:
             raise toolkit.ValidationError(error_list)
 
+        # Reject limits over the resource's maximum, and make sure the default
+        # limit doesn't go over it either
+        max_limit = toolkit.asint(get_resource_option(self.resource_id, u'max_limit', 0))
+        if max_limit:
+            if u'limit' in self.params:
+                if int(self.params[u'limit']) > max_limit:
+                    raise toolkit.ValidationError({
+                        u'limit': [u'must be at most {0} for this '
+                                   u'resource'.format(max_limit)]
+                        })
+            elif max_limit < 100:
+                self.params[u'limit'] = max_limit
+
     def fetch(self):
         '''Run the query and fetch the data'''
         self._check_access()
+        solr_query, solr_params = self.prepare()
+        prefetcher = get_cursor_prefetcher() if u'cursorMark' in solr_params else None
+        if prefetcher:
+            search = prefetcher.fetch(self, solr_query, solr_params)
+        else:
+            search = self.query(solr_query, solr_params)
+        return self.process(search)
+
+    def prepare(self):
+        '''Build the Solr query for this search, running the IDataSolr plugins
+
+
+        :returns: a tuple of the solr query and the solr parameters
+
+        '''
         search_params = {}
 
         # When we perform the fetch, we want to use stored fields
         for plugin in PluginImplementations(IDataSolr):
             search_params = plugin.datasolr_search(self.context, self.params,
                                                    self.stored_fields, search_params)
-        solr_query, solr_params = self.build_query(search_params, self.stored_fields)
 
+        # Make sure the fields needed by the after fetch hooks are requested,
+        # keeping track of those the user didn't ask for so we can drop them.
+        # Distinct queries group on the requested fields, and an empty list of
+        # fields would be narrowed down to the hook fields, so leave those alone
+        self.after_fetch = _after_fetch_plugins()
+        self.hook_only_fields = set()
+        search_fields = list(search_params.get(u'fields') or [])
+        if self.after_fetch and search_fields and \
+                not search_params.get(u'distinct', False):
+            stored_field_names = set(f[u'id'] for f in self.stored_fields)
+            for plugin in self.after_fetch:
+                if not _overrides(plugin, u'datasolr_after_fetch_fields'):
+                    continue
+                for field in plugin.datasolr_after_fetch_fields(self.context,
+                                                                self.params):
+                    if field == u'_id' or field in search_fields:
+                        continue
+                    if field in stored_field_names:
+                        search_fields.append(field)
+                        self.hook_only_fields.add(field)
+            search_params[u'fields'] = search_fields
+
+        return self.build_query(search_params, self.stored_fields)
+
+    def query(self, solr_query, solr_params):
+        '''Send the query to Solr, once admission control allows it
+
+        :param solr_query: the solr query
+        :param solr_params: the solr parameters
+        :returns: the solr response
+
+        '''
+        deep_offset = get_admission_options(self.resource_id)[u'deep_offset']
+        priority = request_priority(self.params, solr_params, deep_offset)
         try:
-            search = self.conn.query(solr_query, **solr_params)
+            with admit(self.resource_id, priority):
+                return self.conn.query(solr_query, **solr_params)
+        except SolrOverloaded:
+            log.warning(u'SOLR OVERLOADED - resource: %s, query: %s, params: %s',
+                        self.resource_id, solr_query, solr_params)
+            raise toolkit.ValidationError({
+                u'resource_id': [u'too many searches are running on this resource, '
+                                 u'please try again later']
+                })
         except solr.SolrException:
             log.critical(u'SOLR ERROR - query: %s, params: %s', solr_query, solr_params)
             raise
+        except SolrResponseTooLarge as e:
+            log.warning(u'SOLR RESPONSE TOO LARGE - query: %s, params: %s', solr_query,
+                        solr_params)
+            raise toolkit.ValidationError({
+                u'limit': [u'the response is larger than the maximum of {0} bytes for '
+                           u'this resource, request fewer records, fields or '
+                           u'facets'.format(e.max_bytes)]
+                })
+
+    def process(self, search):
+        '''Build the API response from the Solr response
+
+        :param search: the solr response
+        :returns: the response dictionary
+
+        '''
 
         # If we have requested indexed only fields, then list of fields will be
         # those indexed; otherwise use the default stored fields
@@ -123,10 +246,15 @@ class SolrSearch(object):
         # if there's no records found - otherwise use numFound
         total = 0 if u'group_field' and not search.results else search.numFound
 
+        # Solr flags the total as inexact when minExactCount cut counting short
+        total_is_estimate = u'{0}'.format(
+            getattr(search, u'numFoundExact', u'true')).lower() == u'false'
+
         response = dict(
             resource_id=self.resource_id,
             fields=fields,
             total=total,
+            total_is_estimate=total_is_estimate,
             records=search.results,
             # indicates that this response came from Solr, this is used by the ckanpackager
             _backend=u'datasolr',
@@ -159,6 +287,16 @@ class SolrSearch(object):
         except AttributeError:
             pass
 
+        if self.after_fetch:
+            fields_index = {f[u'id']: f for f in self.stored_fields}
+            for plugin in self.after_fetch:
+                response = plugin.datasolr_after_fetch(self.context, self.params,
+                                                       fields_index, response)
+            if self.hook_only_fields:
+                for record in response[u'records']:
+                    for field in self.hook_only_fields:
+                        record.pop(field, None)
+
         return response
 
     @staticmethod
@@ -195,6 +333,12 @@ class SolrSearch(object):
         if cursor:
             solr_params[u'cursorMark'] = cursor
 
+        # In approximate mode, let Solr stop counting hits once it has found
+        # enough of them (Solr 8.6+, ignored by older versions)
+        min_exact_count = params.get(u'min_exact_count', None)
+        if params.get(u'approximate', False) and min_exact_count:
+            solr_params[u'minExactCount'] = min_exact_count
+
         # Add facets
         facets = params.get(u'facets', [])
 
@@ -223,23 +367,33 @@ class SolrSearch(object):
         # Q can be either a string, or a dictionary
         q = params.get(u'q', None)
         if isinstance(q, basestring):
+            # Quoted terms containing spaces become phrase queries, every
+            # other term is escaped so it is matched literally
             words = split_words(q, quotes=True)
             for word in words:
-                solr_query.append(u'_fulltext:{}'.format(word))
+                if u' ' in word:
+                    solr_query.append(u'_fulltext:{}'.format(solr_phrase(word)))
+                else:
+                    solr_query.append(u'_fulltext:{}'.format(escape_solr_term(word)))
         elif q:
             # this code implements the field level auto-completion used in the
             # advanced filters. The code mirrors the SQL equivalent in terms of
             # how we detect that the query is an autocompletion query
             if len(q) == 1 and isinstance(q, dict):
-                field_name = q.keys()[0]
-                if field_name in params.get(u'fields', []) and q[field_name].endswith(
-                        u':*'):
-                    solr_query.append(u'{}:*{}*'.format(field_name, q[field_name][:-2]))
+                field_name = list(q.keys())[0]
+                # Values can be numbers as well as strings
+                value = unicode(q[field_name])
+                if field_name in params.get(u'fields', []) and value.endswith(u':*'):
+                    solr_query.append(u'{}:*{}*'.format(field_name,
+                                                       escape_solr_term(value[:-2])))
             else:
+                # field_names may be field names or field dicts (as passed by fetch)
+                names = [f[u'id'] if isinstance(f, dict) else f for f in field_names]
                 for field in q:
-                    if field not in field_names:
+                    if field not in names:
                         continue
-                    solr_query.append(u'{}:*{}*'.format(field, q[u'field']))
+                    solr_query.append(u'{}:*{}*'.format(field,
+                                                       escape_solr_term(unicode(q[field]))))
 
         filters = params.get(u'filters', None)
         if filters:
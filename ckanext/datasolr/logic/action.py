@@ -4,6 +4,7 @@
 # This file is part of ckanext-datasolr
 # Created by the Natural History Museum in London, UK
 
+from ckanext.datasolr.lib.federated_search import FederatedSolrSearch
 from ckanext.datasolr.lib.helpers import is_datasolr_resource
 from ckanext.datasolr.lib.solr_search import SolrSearch
 
@@ -45,6 +46,10 @@ def datastore_search(prev_func, context, data_dict):
                  e.g.: "fieldname1, fieldname2 desc"
     :param count: If True, the result will include a 'total' field
                   to the total number of matching rows. (optional, default: True)
+    :param approximate: If True, Solr may stop counting matching rows early, so
+                        the total can be an estimate; if False, the total is
+                        always exact (optional, default: configured per resource)
+    :type approximate: bool
     :param fields: fields/columns and their extra metadata
     :type fields: list of dictionaries
     :param offset: query offset value
@@ -55,6 +60,8 @@ def datastore_search(prev_func, context, data_dict):
     :type filters: list of dictionaries
     :param total: number of total matching records
     :type total: int
+    :param total_is_estimate: True if ``total`` is an estimate
+    :type total_is_estimate: bool
     :param records: list of matching results
     :type records: list of dictionaries
     :param context: param data_dict:
@@ -75,3 +82,42 @@ def datastore_search(prev_func, context, data_dict):
     solr_search = SolrSearch(resource_id, context, data_dict)
     solr_search.validate()
     return solr_search.fetch()
+
+
+@logic.side_effect_free
+def datasolr_federated_search(context, data_dict):
+    '''Search several datasolr resources in one request.
+
+    One query is built per resource and they are sent to Solr concurrently,
+    so the time taken is that of the slowest resource. The records are merged
+    into a single sorted, paginated list. Accepts the same parameters as
+    datastore_search, except for ``cursor``.
+
+    :param resource_ids: ids of the datasolr resources to be searched against
+    :type resource_ids: list or comma separated string
+    :param limit: maximum number of merged rows to return (optional, default: 100)
+    :type limit: int
+    :param offset: offset this number of merged rows (optional)
+    :type offset: int
+    :param sort: comma separated field names with ordering, applied to each
+                 resource and to the merged records
+                 e.g.: "fieldname1, fieldname2 desc"
+
+    **Results:**
+
+    :param resource_ids: the resources searched
+    :type resource_ids: list of strings
+    :param total: number of total matching records across all resources
+    :type total: int
+    :param total_is_estimate: True if the total of any resource is an estimate
+    :type total_is_estimate: bool
+    :param records: list of matching results, each with a ``_resource_id``
+    :type records: list of dictionaries
+    :param resources: the ``total``, ``total_is_estimate``, ``fields`` and
+                      ``facets`` of each resource, keyed by resource id
+    :type resources: dictionary
+
+    '''
+    federated_search = FederatedSolrSearch(context, data_dict)
+    federated_search.validate()
+    return federated_search.fetch()
@@ -30,4 +30,6 @@ def datastore_search_schema():
     schema[u'facets_limit'] = [ignore_missing, int_validator]
     schema[u'facets_field_limit'] = [ignore_missing, json_validator]
     schema[u'indexed_only'] = [ignore_missing, bool_validator]
+    # Optional estimated totals, for very large resources
+    schema[u'approximate'] = [ignore_missing, bool_validator]
     return schema
@@ -6,10 +6,11 @@
 
 import re
 from ckanext.datasolr.interfaces import IDataSolr
+from ckanext.datasolr.lib.config import get_resource_option
 from ckanext.datasolr.lib.helpers import is_datasolr_resource
-from ckanext.datasolr.logic.action import datastore_search
+from ckanext.datasolr.logic.action import datasolr_federated_search, datastore_search
 
-from ckan.plugins import interfaces, SingletonPlugin, implements
+from ckan.plugins import interfaces, SingletonPlugin, implements, toolkit
 
 
 class DataSolrPlugin(SingletonPlugin):
@@ -21,7 +22,8 @@ class DataSolrPlugin(SingletonPlugin):
     # IActions
     def get_actions(self):
         return {
-            u'datastore_search': datastore_search
+            u'datastore_search': datastore_search,
+            u'datasolr_federated_search': datasolr_federated_search
             }
 
     # ITemplateHelpers
@@ -75,7 +77,7 @@ class DataSolrPlugin(SingletonPlugin):
 
         # Remove all the known fields
         for field in [u'distinct', u'cursor', u'facets', u'facets_limit',
-                      u'indexed_only']:
+                      u'indexed_only', u'approximate']:
             data_dict.pop(field, None)
 
         # Validate offset & limit as integers
@@ -112,7 +114,15 @@ class DataSolrPlugin(SingletonPlugin):
                             limit=data_dict.get(u'limit', 100),
                             sort=data_dict.get(u'sort'),
                             distinct=data_dict.get(u'distinct', False),
-                            cursor=data_dict.get(u'cursor', None),)
+                            cursor=data_dict.get(u'cursor', None),
+                            approximate=data_dict.get(u'approximate', None),)
+        # Fall back on the configured default if the user didn't choose
+        if query_params[u'approximate'] is None:
+            query_params[u'approximate'] = toolkit.asbool(
+                get_resource_option(data_dict[u'resource_id'], u'approximate', False))
+        if query_params[u'approximate']:
+            query_params[u'min_exact_count'] = toolkit.asint(
+                get_resource_option(data_dict[u'resource_id'], u'min_exact_count', 1000))
         query_params[u'fields'] = data_dict.get(u'fields', [f[u'id'] for f in fields])
         cursor = data_dict.get(u'cursor', None)
         if cursor:
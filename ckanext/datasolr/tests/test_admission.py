@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# This file is part of ckanext-datasolr
+# Created by the Natural History Museum in London, UK
+
+import threading
+import time
+import unittest
+
+import mock
+from ckanext.datasolr.exceptions import SolrOverloaded
+from ckanext.datasolr.lib import admission
+from ckanext.datasolr.lib.admission import (CHEAP, EXPENSIVE, NORMAL, ConcurrencyLimiter,
+                                            admit, request_priority)
+
+from ckan.plugins import toolkit
+
+
+def wait_until(condition, timeout=5):
+    '''Wait for a condition to become true'''
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, u'timed out'
+        time.sleep(0.01)
+
+
+def assert_overloaded(func, *args, **kwargs):
+    try:
+        func(*args, **kwargs)
+    except SolrOverloaded:
+        pass
+    else:
+        assert False, u'SolrOverloaded not raised'
+
+
+class TestRequestPriority(object):
+
+    def test_autocomplete_is_cheap(self):
+        params = {u'q': {u'genus': u'Pan:*'}}
+        assert request_priority(params, {u'rows': 20}, 10000) == CHEAP
+
+    def test_autocomplete_with_facets_or_deep_offset_is_expensive(self):
+        params = {u'q': {u'genus': u'Pan:*'}}
+        assert request_priority(params, {u'rows': 20, u'facet': u'true'},
+                                10000) == EXPENSIVE
+        assert request_priority(params, {u'rows': 20, u'group': u'true'},
+                                10000) == EXPENSIVE
+        assert request_priority(params, {u'rows': 20, u'start': 500000},
+                                10000) == EXPENSIVE
+
+    def test_multiple_field_query_is_not_cheap(self):
+        params = {u'q': {u'genus': u'Pan', u'species': u'x'}}
+        assert request_priority(params, {u'rows': 100}, 10000) == NORMAL
+        params = {u'q': {u'genus': u'Pan:*', u'species': u'x:*'}}
+        assert request_priority(params, {u'rows': 100}, 10000) == NORMAL
+
+    def test_single_field_query_without_wildcard_is_not_cheap(self):
+        params = {u'q': {u'genus': u'Pan'}}
+        assert request_priority(params, {u'rows': 100}, 10000) == NORMAL
+        params = {u'q': {u'year': 1990}}
+        assert request_priority(params, {u'rows': 100}, 10000) == NORMAL
+
+    def test_count_is_cheap(self):
+        assert request_priority({}, {u'rows': 0}, 10000) == CHEAP
+
+    def test_search_is_normal(self):
+        assert request_priority({u'q': u'fox'}, {u'rows': 100}, 10000) == NORMAL
+        assert request_priority({}, {u'rows': 100, u'start': 9999}, 10000) == NORMAL
+
+    def test_expensive(self):
+        assert request_priority({}, {u'rows': 0, u'facet': u'true'}, 10000) == EXPENSIVE
+        assert request_priority({}, {u'rows': 100, u'group': u'true'}, 10000) == EXPENSIVE
+        assert request_priority({}, {u'rows': 100, u'start': 10000}, 10000) == EXPENSIVE
+
+
+class TestConcurrencyLimiter(object):
+
+    def test_admits_up_to_the_limit(self):
+        limiter = ConcurrencyLimiter(u'r', 2, 0, 1)
+        limiter.acquire(NORMAL)
+        limiter.acquire(NORMAL)
+        assert_overloaded(limiter.acquire, NORMAL)
+        limiter.release()
+        limiter.acquire(NORMAL)
+
+    def test_refuses_when_queue_is_full(self):
+        limiter = ConcurrencyLimiter(u'r', 1, 1, 5)
+        limiter.acquire(NORMAL)
+        queued = threading.Thread(target=limiter.acquire, args=(NORMAL,))
+        queued.start()
+        wait_until(lambda: len(limiter._waiting) == 1)
+        start = time.time()
+        assert_overloaded(limiter.acquire, CHEAP)
+        # Refused straight away, rather than after the queue timeout
+        assert time.time() - start < 1
+        limiter.release()
+        queued.join(5)
+        assert limiter._active == 1
+
+    def test_refuses_without_waiting(self):
+        limiter = ConcurrencyLimiter(u'r', 1, 5, 5)
+        limiter.acquire(NORMAL)
+        assert_overloaded(limiter.acquire, CHEAP, wait=False)
+        assert not limiter._waiting
+
+    def test_times_out_in_the_queue(self):
+        limiter = ConcurrencyLimiter(u'r', 1, 5, 0.1)
+        limiter.acquire(NORMAL)
+        start = time.time()
+        assert_overloaded(limiter.acquire, NORMAL)
+        assert 0.1 <= time.time() - start < 1
+        assert not limiter._waiting
+        assert limiter._active == 1
+
+    def test_timing_out_unblocks_the_queue(self):
+        limiter = ConcurrencyLimiter(u'r', 1, 5, 0.2)
+        limiter.acquire(NORMAL)
+        results = []
+
+        def acquire(priority, timeout):
+            limiter.queue_timeout = timeout
+            try:
+                limiter.acquire(priority)
+                results.append(priority)
+            except SolrOverloaded:
+                results.append(u'refused')
+
+        # The cheap request is at the head of the queue, and times out first
+        head = threading.Thread(target=acquire, args=(CHEAP, 0.1))
+        head.start()
+        wait_until(lambda: len(limiter._waiting) == 1)
+        behind = threading.Thread(target=acquire, args=(EXPENSIVE, 5))
+        behind.start()
+        wait_until(lambda: len(limiter._waiting) == 2)
+        head.join(5)
+        limiter.release()
+        behind.join(5)
+        assert results == [u'refused', EXPENSIVE]
+
+    def test_admits_by_priority(self):
+        limiter = ConcurrencyLimiter(u'r', 1, 5, 5)
+        limiter.acquire(NORMAL)
+        admitted = []
+
+        def acquire(name, priority):
+            limiter.acquire(priority)
+            admitted.append(name)
+            limiter.release()
+
+        threads = []
+        for name, priority in [(u'expensive 1', EXPENSIVE), (u'expensive 2', EXPENSIVE),
+                               (u'normal', NORMAL), (u'cheap', CHEAP)]:
+            thread = threading.Thread(target=acquire, args=(name, priority))
+            thread.start()
+            threads.append(thread)
+            wait_until(lambda: len(limiter._waiting) == len(threads))
+        limiter.release()
+        for thread in threads:
+            thread.join(5)
+        assert admitted == [u'cheap', u'normal', u'expensive 1', u'expensive 2']
+        assert limiter._active == 0
+
+
+class TestAdmit(unittest.TestCase):
+
+    def tearDown(self):
+        admission._limiters.clear()
+
+    def test_unlimited_by_default(self):
+        with admit(u'unlimited', EXPENSIVE):
+            pass
+        assert admission._limiters[u'unlimited'] is None
+
+    def test_holds_a_slot(self):
+        config = {u'datasolr.resource.limited.max_concurrent': u'1'}
+        with mock.patch.dict(toolkit.config, config):
+            with admit(u'limited', NORMAL):
+                assert_overloaded(admit(u'limited', CHEAP, wait=False).__enter__)
+            with admit(u'limited', NORMAL):
+                pass
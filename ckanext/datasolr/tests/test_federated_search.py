@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# This file is part of ckanext-datasolr
+# Created by the Natural History Museum in London, UK
+
+import mock
+from ckanext.datasolr.lib.federated_search import (FederatedSolrSearch, merge_records,
+                                                   missing_last_sort, parse_sort)
+
+from ckan.plugins import toolkit
+
+
+def make_search(resource_id, records, sort=None):
+    '''Build a mock SolrSearch returning the given records'''
+    search = mock.Mock(resource_id=resource_id, params={u'sort': sort})
+    search.prepare.return_value = (u'*:*', {u'score': False, u'rows': 10})
+    search.query.return_value = records
+    search.process.side_effect = lambda result: dict(resource_id=resource_id,
+                                                     records=result, total=len(result),
+                                                     total_is_estimate=False, fields=[])
+    return search
+
+
+class TestSort(object):
+
+    def test_parse_sort(self):
+        assert parse_sort(u'a, b desc,c ASC') == [(u'a', False), (u'b', True),
+                                                  (u'c', False)]
+        assert parse_sort([(u'_id', u'ASC')]) == [(u'_id', False)]
+        assert parse_sort(None) == []
+
+    def test_missing_last_sort(self):
+        assert missing_last_sort(u'a, b desc') == [u'exists(a) desc', u'a asc',
+                                                   u'exists(b) desc', u'b desc']
+
+    def test_merge_records(self):
+        first = [{u'x': 1, u'y': u'b'}, {u'x': 3, u'y': u'a'}]
+        second = [{u'x': 2, u'y': u'a'}, {u'y': u'z'}]
+        assert merge_records([first, second], u'y asc, x desc') == [
+            {u'x': 3, u'y': u'a'}, {u'x': 2, u'y': u'a'}, {u'x': 1, u'y': u'b'},
+            {u'y': u'z'}]
+
+    def test_missing_values_last_in_both_directions(self):
+        records = [[{u'x': None}, {u'x': 1}], [{u'x': 2}]]
+        assert [r[u'x'] for r in merge_records(records, u'x asc')] == [1, 2, None]
+        assert [r[u'x'] for r in merge_records(records, u'x desc')] == [2, 1, None]
+
+    def test_no_sort_keeps_resource_order(self):
+        assert merge_records([[{u'a': 2}], [{u'a': 1}]], None) == [{u'a': 2}, {u'a': 1}]
+
+
+class TestFederatedSolrSearch(object):
+
+    def test_resource_ids_are_deduplicated(self):
+        search = FederatedSolrSearch({}, {u'resource_ids': [u'a', u'b', u'a']})
+        assert search.resource_ids == [u'a', u'b']
+
+    def test_too_many_resources(self):
+        search = FederatedSolrSearch({}, {u'resource_ids': [u'a', u'b', u'c']})
+        with mock.patch.dict(toolkit.config, {u'datasolr.federated_max_resources': u'2'}):
+            try:
+                search.validate()
+            except toolkit.ValidationError as e:
+                assert u'resource_ids' in e.error_dict
+            else:
+                assert False, u'ValidationError not raised'
+
+    def test_free_text_merges_on_score(self):
+        search = FederatedSolrSearch({}, {u'resource_ids': [u'a', u'b'], u'q': u'fox'})
+        search.searches = [make_search(u'a', [{u'_id': 1, u'score': 0.5}]),
+                           make_search(u'b', [{u'_id': 2, u'score': 0.9}])]
+        response = search.fetch()
+        assert [(r[u'_resource_id'], r[u'_id']) for r in response[u'records']] == [
+            (u'b', 2), (u'a', 1)]
+        assert all(u'score' not in r for r in response[u'records'])
+        for resource_search in search.searches:
+            assert resource_search.query.call_args[0][1][u'score'] is True
+
+    def test_sort_puts_missing_values_last(self):
+        search = FederatedSolrSearch({}, {u'resource_ids': [u'a', u'b']})
+        search.searches = [make_search(u'a', [{u'_id': 1, u'x': 2}], u'x'),
+                           make_search(u'b', [{u'_id': 2}, {u'_id': 3, u'x': 1}], u'x')]
+        response = search.fetch()
+        assert [r[u'_id'] for r in response[u'records']] == [3, 1, 2]
+        for resource_search in search.searches:
+            assert resource_search.query.call_args[0][1][u'sort'] == [
+                u'exists(x) desc', u'x asc']
+
+    def test_pagination(self):
+        search = FederatedSolrSearch({}, {u'resource_ids': [u'a', u'b']})
+        search.offset = 1
+        search.limit = 2
+        search.searches = [make_search(u'a', [{u'x': 1}, {u'x': 3}], u'x'),
+                           make_search(u'b', [{u'x': 2}, {u'x': 4}], u'x')]
+        response = search.fetch()
+        assert [r[u'x'] for r in response[u'records']] == [2, 3]
+        assert response[u'total'] == 4
+
+    def test_offset_and_limit_within_max_limit(self):
+        search = FederatedSolrSearch({}, {u'resource_ids': [u'a'], u'offset': 90,
+                                          u'limit': 20})
+        config = {u'datasolr.resource.a.max_limit': u'100'}
+        with mock.patch.dict(toolkit.config, config), \
+                mock.patch(u'ckanext.datasolr.lib.federated_search.is_datasolr_resource',
+                           return_value=True):
+            try:
+                search.validate()
+            except toolkit.ValidationError as e:
+                assert list(e.error_dict.keys()) == [u'offset']
+            else:
+                assert False, u'ValidationError not raised'
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# This file is part of ckanext-datasolr
+# Created by the Natural History Museum in London, UK
+
+import random
+import re
+
+from ckanext.datasolr.lib.helpers import escape_solr_term, solr_phrase, split_words
+
+
+def regex_split_words(phrase):
+    '''The original, regex based, implementation of split_words(phrase, quotes=True)'''
+    nb_q = len(re.sub(u'[^"]', u'', phrase))
+    if nb_q % 2 == 1:
+        phrase += u'"'
+    parts = re.split(u' (?=(?:[^"]|"[^"]*")*$)', phrase)
+    words = []
+    for w in parts:
+        if w.endswith(u'"'):
+            w = w[:-1]
+        if w.startswith(u'"'):
+            w = w[1:]
+        w = w.replace(u'""', u'"')
+        if w:
+            words.append(w)
+    return words
+
+
+class TestSplitWords(object):
+
+    def test_splits_on_spaces(self):
+        assert split_words(u'a  b c') == [u'a', u'b', u'c']
+
+    def test_keeps_quoted_terms_together(self):
+        assert split_words(u'a "b c" d') == [u'a', u'b c', u'd']
+
+    def test_doubled_quotes_are_escaped(self):
+        assert split_words(u'"say ""hi"""') == [u'say "hi"']
+
+    def test_unbalanced_quotes_run_to_the_end(self):
+        assert split_words(u'a "b c') == [u'a', u'b c']
+
+    def test_quotes_ignored(self):
+        assert split_words(u'a "b c"', quotes=False) == [u'a', u'"b', u'c"']
+
+    def test_matches_regex_implementation(self):
+        rand = random.Random(42)
+        for _ in range(20000):
+            phrase = u''.join(rand.choice(u'ab "  "x')
+                              for _ in range(rand.randint(0, 12)))
+            assert split_words(phrase) == regex_split_words(phrase), phrase
+
+    def test_long_queries(self):
+        words = split_words(u'"a b" ' * 100000)
+        assert len(words) == 100000
+
+
+class TestEscapeSolrTerm(object):
+
+    def test_plain_term(self):
+        assert escape_solr_term(u'specimen') == u'specimen'
+
+    def test_special_characters(self):
+        assert escape_solr_term(u'a*b?c:d') == u'a\\*b\\?c\\:d'
+        assert escape_solr_term(u'(x)[y]{z}') == u'\\(x\\)\\[y\\]\\{z\\}'
+        assert escape_solr_term(u'-a+b!c') == u'\\-a\\+b\\!c'
+        assert escape_solr_term(u'a\\b/c') == u'a\\\\b\\/c'
+
+    def test_operators(self):
+        assert escape_solr_term(u'AND') == u'\\AND'
+        assert escape_solr_term(u'OR') == u'\\OR'
+        assert escape_solr_term(u'NOT') == u'\\NOT'
+        assert escape_solr_term(u'&&') == u'\\&\\&'
+
+    def test_lowercase_operators_are_plain_terms(self):
+        assert escape_solr_term(u'and') == u'and'
+        assert escape_solr_term(u'ANDROID') == u'ANDROID'
+
+
+class TestSolrPhrase(object):
+
+    def test_quotes_phrase(self):
+        assert solr_phrase(u'a b') == u'"a b"'
+
+    def test_escapes_quotes_and_backslashes(self):
+        assert solr_phrase(u'say "hi" \\') == u'"say \\"hi\\" \\\\"'
+
+    def test_special_characters_are_kept(self):
+        assert solr_phrase(u'a* OR b') == u'"a* OR b"'
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# This file is part of ckanext-datasolr
+# Created by the Natural History Museum in London, UK
+
+import time
+import unittest
+
+import mock
+from ckanext.datasolr.exceptions import SolrOverloaded
+from ckanext.datasolr.lib.prefetch import CursorPrefetcher, query_signature
+
+PARAMS = {u'rows': 10, u'cursorMark': u'*'}
+
+
+def page(cursor, next_cursor):
+    '''Build a mock solr response'''
+    return mock.Mock(results=[cursor], nextCursorMark=next_cursor)
+
+
+def make_search(next_cursors):
+    '''Build a mock SolrSearch, whose live queries return pages whose next
+    cursor is looked up in next_cursors'''
+    search = mock.Mock(resource_id=u'resource', solr_url=u'http://solr/core',
+                       conn_options={})
+    search.query.side_effect = lambda q, params: page(
+        params[u'cursorMark'], next_cursors[params[u'cursorMark']])
+    return search
+
+
+def make_connection(next_cursors):
+    '''Build a mock SolrConnection class for the background prefetches'''
+    connection = mock.Mock()
+    connection.return_value.query.side_effect = lambda q, **params: page(
+        params[u'cursorMark'], next_cursors[params[u'cursorMark']])
+    return connection
+
+
+def wait_for(prefetcher, cursor):
+    '''Wait for the prefetch of a cursor to complete'''
+    for (signature, entry_cursor), entry in list(prefetcher._entries.items()):
+        if entry_cursor == cursor:
+            assert entry.ready.wait(5)
+
+
+class TestQuerySignature(object):
+
+    def test_ignores_cursor_mark(self):
+        assert query_signature(u'r', u'*:*', dict(PARAMS, cursorMark=u'a')) == \
+            query_signature(u'r', u'*:*', dict(PARAMS, cursorMark=u'b'))
+
+    def test_depends_on_the_query(self):
+        assert query_signature(u'r', u'*:*', PARAMS) != \
+            query_signature(u'r', u'a:b', PARAMS)
+        assert query_signature(u'r', u'*:*', PARAMS) != \
+            query_signature(u'r', u'*:*', dict(PARAMS, rows=20))
+        assert query_signature(u'r', u'*:*', PARAMS) != \
+            query_signature(u's', u'*:*', PARAMS)
+
+
+class TestCursorPrefetcher(unittest.TestCase):
+
+    def setUp(self):
+        self.next_cursors = {u'*': u'c1', u'c1': u'c2', u'c2': u'c2'}
+        self.search = make_search(self.next_cursors)
+        self.prefetcher = CursorPrefetcher(8, 60, 1000, 1)
+
+    def test_hit_is_served_once(self):
+        connection = make_connection(self.next_cursors)
+        with mock.patch(u'ckanext.datasolr.lib.prefetch.SolrConnection', connection):
+            self.prefetcher.fetch(self.search, u'*:*', PARAMS)
+            wait_for(self.prefetcher, u'c1')
+            assert self.search.query.call_count == 1
+
+            result = self.prefetcher.fetch(self.search, u'*:*',
+                                           dict(PARAMS, cursorMark=u'c1'))
+            assert result.results == [u'c1']
+            assert self.search.query.call_count == 1
+            wait_for(self.prefetcher, u'c2')
+
+            # The same page again is a miss
+            result = self.prefetcher.fetch(self.search, u'*:*',
+                                           dict(PARAMS, cursorMark=u'c1'))
+            assert result.results == [u'c1']
+            assert self.search.query.call_count == 2
+
+    def test_no_prefetch_at_the_end(self):
+        connection = make_connection(self.next_cursors)
+        with mock.patch(u'ckanext.datasolr.lib.prefetch.SolrConnection', connection):
+            self.prefetcher.fetch(self.search, u'*:*', dict(PARAMS, cursorMark=u'c2'))
+        assert not self.prefetcher._entries
+        assert not connection.called
+
+    def test_large_pages_are_not_prefetched(self):
+        connection = make_connection(self.next_cursors)
+        with mock.patch(u'ckanext.datasolr.lib.prefetch.SolrConnection', connection):
+            self.prefetcher.fetch(self.search, u'*:*', dict(PARAMS, rows=1001))
+        assert not self.prefetcher._entries
+
+    def test_eviction_when_full(self):
+        prefetcher = CursorPrefetcher(2, 60, 1000, 1)
+        for key in [u'a', u'b', u'c']:
+            assert prefetcher._reserve((u'signature', key)) is not None
+        assert list(prefetcher._entries.keys()) == [(u'signature', u'b'),
+                                                    (u'signature', u'c')]
+
+    def test_reserving_twice(self):
+        assert self.prefetcher._reserve((u'signature', u'a')) is not None
+        assert self.prefetcher._reserve((u'signature', u'a')) is None
+
+    def test_ttl_expiry(self):
+        entry = self.prefetcher._reserve((u'signature', u'a'))
+        entry.search = page(u'a', u'b')
+        entry.ready.set()
+        entry.created -= 61
+        assert self.prefetcher._take((u'signature', u'a')) is None
+        assert not self.prefetcher._entries
+
+    def test_failed_prefetch_falls_back_to_live_query(self):
+        connection = mock.Mock()
+        connection.return_value.query.side_effect = Exception(u'Solr is down')
+        with mock.patch(u'ckanext.datasolr.lib.prefetch.SolrConnection', connection):
+            self.prefetcher.fetch(self.search, u'*:*', PARAMS)
+            wait_for(self.prefetcher, u'c1')
+            result = self.prefetcher.fetch(self.search, u'*:*',
+                                           dict(PARAMS, cursorMark=u'c1'))
+            wait_for(self.prefetcher, u'c2')
+        assert result.results == [u'c1']
+        assert self.search.query.call_count == 2
+
+    def test_dropped_prefetch_falls_back_to_live_query(self):
+        connection = make_connection(self.next_cursors)
+        admit = mock.Mock(side_effect=SolrOverloaded(u'resource'))
+        with mock.patch(u'ckanext.datasolr.lib.prefetch.SolrConnection', connection), \
+                mock.patch(u'ckanext.datasolr.lib.prefetch.admit', admit):
+            self.prefetcher.fetch(self.search, u'*:*', PARAMS)
+            wait_for(self.prefetcher, u'c1')
+            result = self.prefetcher.fetch(self.search, u'*:*',
+                                           dict(PARAMS, cursorMark=u'c1'))
+            wait_for(self.prefetcher, u'c2')
+        assert result.results == [u'c1']
+        assert self.search.query.call_count == 2
+        assert not connection.called
+
+    def test_stuck_prefetch_falls_back_to_live_query(self):
+        prefetcher = CursorPrefetcher(8, 60, 1000, 0.05)
+        signature = query_signature(u'resource', u'*:*', PARAMS)
+        prefetcher._reserve((signature, u'c1'))
+        start = time.time()
+        result = prefetcher.fetch(self.search, u'*:*', dict(PARAMS, cursorMark=u'c1'))
+        assert time.time() - start < 1
+        assert result.results == [u'c1']
+        assert self.search.query.call_count == 1
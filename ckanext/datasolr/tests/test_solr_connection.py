@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# This file is part of ckanext-datasolr
+# Created by the Natural History Museum in London, UK
+
+import io
+import zlib
+
+import mock
+from ckanext.datasolr.exceptions import SolrResponseTooLarge
+from ckanext.datasolr.lib.solr_connection import DecodedResponse
+
+BODY = b'<response>' + b'x' * 500000 + b'</response>'
+
+
+def compress(data, wbits):
+    compressor = zlib.compressobj(9, zlib.DEFLATED, wbits)
+    return compressor.compress(data) + compressor.flush()
+
+
+def make_response(data, encoding=None):
+    '''Build a mock HTTP response'''
+    response = mock.Mock()
+    response.read.side_effect = io.BytesIO(data).read
+    response.getheader.return_value = encoding
+    return response
+
+
+class TestDecodedResponse(object):
+
+    def test_plain(self):
+        assert DecodedResponse(make_response(BODY), 0, None).read() == BODY
+
+    def test_gzip(self):
+        response = make_response(compress(BODY, 16 + zlib.MAX_WBITS), u'gzip')
+        assert DecodedResponse(response, 0, None).read() == BODY
+
+    def test_deflate(self):
+        response = make_response(compress(BODY, zlib.MAX_WBITS), u'deflate')
+        assert DecodedResponse(response, 0, None).read() == BODY
+
+    def test_raw_deflate(self):
+        response = make_response(compress(BODY, -zlib.MAX_WBITS), u'deflate')
+        assert DecodedResponse(response, 0, None).read() == BODY
+
+    def test_too_large(self):
+        on_abort = mock.Mock()
+        response = make_response(compress(BODY, 16 + zlib.MAX_WBITS), u'gzip')
+        try:
+            DecodedResponse(response, 100000, on_abort).read()
+        except SolrResponseTooLarge as e:
+            assert e.max_bytes == 100000
+        else:
+            assert False, u'SolrResponseTooLarge not raised'
+        assert on_abort.called
+
+    def test_within_limit(self):
+        response = make_response(BODY)
+        assert DecodedResponse(response, len(BODY), None).read() == BODY
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# This file is part of ckanext-datasolr
+# Created by the Natural History Museum in London, UK
+
+import mock
+from ckanext.datasolr.interfaces import IDataSolr
+from ckanext.datasolr.lib.solr_search import SolrSearch, _after_fetch_plugins, _overrides
+
+FIELDS = [{u'id': u'_id', u'type': u'int'}, {u'id': u'genus', u'type': u'text'},
+          {u'id': u'species', u'type': u'text'}]
+
+
+class TestBuildQuery(object):
+
+    def test_free_text_terms_are_escaped(self):
+        query, _ = SolrSearch.build_query({u'q': u'a* b:c'}, FIELDS)
+        assert query == u'_fulltext:a\\* AND _fulltext:b\\:c'
+
+    def test_quoted_free_text_is_a_phrase(self):
+        query, _ = SolrSearch.build_query({u'q': u'"red fox" den'}, FIELDS)
+        assert query == u'_fulltext:"red fox" AND _fulltext:den'
+
+    def test_free_text_operators_are_plain_terms(self):
+        query, _ = SolrSearch.build_query({u'q': u'cats AND NOT dogs'}, FIELDS)
+        assert query == (u'_fulltext:cats AND _fulltext:\\AND AND _fulltext:\\NOT '
+                         u'AND _fulltext:dogs')
+
+    def test_multiple_field_query(self):
+        q = {u'genus': u'Pan', u'species': u'trog*', u'unknown': u'x'}
+        query, _ = SolrSearch.build_query({u'q': q}, FIELDS)
+        assert sorted(query.split(u' AND ')) == [u'genus:*Pan*', u'species:*trog\\**']
+
+    def test_multiple_field_query_with_numbers(self):
+        q = {u'genus': 1990, u'species': u'x'}
+        query, _ = SolrSearch.build_query({u'q': q}, FIELDS)
+        assert sorted(query.split(u' AND ')) == [u'genus:*1990*', u'species:*x*']
+
+    def test_autocomplete(self):
+        params = {u'q': {u'genus': u'P(a:*'}, u'fields': [u'genus']}
+        query, _ = SolrSearch.build_query(params, FIELDS)
+        assert query == u'genus:*P\\(a*'
+
+    def test_autocomplete_with_a_number(self):
+        params = {u'q': {u'genus': 1990}, u'fields': [u'genus']}
+        query, _ = SolrSearch.build_query(params, FIELDS)
+        assert query == u'*:*'
+
+    def test_no_query_matches_everything(self):
+        query, _ = SolrSearch.build_query({}, FIELDS)
+        assert query == u'*:*'
+
+    def test_approximate(self):
+        params = {u'approximate': True, u'min_exact_count': 500, u'facets': [u'genus']}
+        _, solr_params = SolrSearch.build_query(params, FIELDS)
+        assert solr_params[u'minExactCount'] == 500
+        assert u'facet_method' not in solr_params
+
+    def test_exact(self):
+        params = {u'approximate': False, u'min_exact_count': 500}
+        _, solr_params = SolrSearch.build_query(params, FIELDS)
+        assert u'minExactCount' not in solr_params
+
+
+class DefaultPlugin(object):
+    '''A plugin inheriting the default IDataSolr methods, as implements(IDataSolr,
+    inherit=True) does'''
+    datasolr_after_fetch = IDataSolr.__dict__[u'datasolr_after_fetch']
+    datasolr_after_fetch_fields = IDataSolr.__dict__[u'datasolr_after_fetch_fields']
+
+    def datasolr_search(self, context, data_dict, fields, query_dict):
+        return dict(query_dict, fields=list(data_dict.get(u'fields', [])),
+                    distinct=data_dict.get(u'distinct', False))
+
+
+class HookPlugin(DefaultPlugin):
+    '''A plugin implementing the after fetch hook, which needs the species'''
+
+    def datasolr_after_fetch_fields(self, context, data_dict):
+        return [u'_id', u'species', u'unknown']
+
+    def datasolr_after_fetch(self, context, data_dict, fields_index, response):
+        for record in response[u'records']:
+            record[u'name'] = u'{0} {1}'.format(record[u'genus'], record[u'species'])
+        return response
+
+
+def make_search(params):
+    '''Build a SolrSearch, without connecting to Solr'''
+    conn = mock.Mock()
+    conn.indexed_fields.return_value = FIELDS
+    conn.stored_fields.return_value = FIELDS
+    with mock.patch(u'ckanext.datasolr.lib.solr_search.get_datasolr_resources',
+                    return_value={u'resource': u'http://solr/core'}), \
+            mock.patch(u'ckanext.datasolr.lib.solr_search.SolrConnection',
+                       return_value=conn):
+        search = SolrSearch(u'resource', {}, params)
+    search.params[u'resource_id'] = u'resource'
+    return search
+
+
+def patch_plugins(plugins):
+    return mock.patch(u'ckanext.datasolr.lib.solr_search.PluginImplementations',
+                      return_value=plugins)
+
+
+def solr_response(records):
+    return mock.Mock(results=records, numFound=len(records), numFoundExact=u'true',
+                     spec=[u'results', u'numFound', u'numFoundExact'])
+
+
+class TestAfterFetch(object):
+
+    def test_overrides(self):
+        assert not _overrides(DefaultPlugin(), u'datasolr_after_fetch')
+        assert _overrides(HookPlugin(), u'datasolr_after_fetch')
+        assert not _overrides(object(), u'datasolr_after_fetch')
+
+    def test_after_fetch_plugins(self):
+        hook = HookPlugin()
+        with patch_plugins([DefaultPlugin(), hook, object()]):
+            assert _after_fetch_plugins() == [hook]
+
+    def test_hook_fields_are_requested_and_stripped(self):
+        search = make_search({u'fields': [u'genus']})
+        with patch_plugins([HookPlugin()]):
+            _, solr_params = search.prepare()
+        assert solr_params[u'fields'] == [u'_id', u'genus', u'species']
+        assert search.hook_only_fields == {u'species'}
+
+        response = search.process(solr_response(
+            [{u'_id': 1, u'genus': u'Pan', u'species': u'troglodytes'}]))
+        assert response[u'records'] == [
+            {u'_id': 1, u'genus': u'Pan', u'name': u'Pan troglodytes'}]
+
+    def test_distinct_fields_are_unchanged(self):
+        search = make_search({u'fields': [u'genus'], u'distinct': True})
+        with patch_plugins([HookPlugin()]):
+            _, solr_params = search.prepare()
+        assert solr_params[u'fields'] == [u'_id', u'genus']
+        assert not search.hook_only_fields
+
+    def test_empty_fields_are_unchanged(self):
+        search = make_search({u'fields': []})
+        with patch_plugins([HookPlugin()]):
+            _, solr_params = search.prepare()
+        assert solr_params[u'fields'] == [u'_id']
+        assert not search.hook_only_fields
+
+    def test_hook_not_called_when_not_overridden(self):
+        search = make_search({u'fields': [u'genus']})
+        with patch_plugins([DefaultPlugin()]) as plugin_implementations:
+            _, solr_params = search.prepare()
+            plugin_implementations.reset_mock()
+            response = search.process(solr_response([{u'_id': 1, u'genus': u'Pan'}]))
+        assert search.after_fetch == []
+        # process doesn't even look for plugins
+        assert not plugin_implementations.called
+        assert solr_params[u'fields'] == [u'_id', u'genus']
+        assert response[u'records'] == [{u'_id': 1, u'genus': u'Pan'}]